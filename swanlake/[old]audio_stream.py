@@ -1,5 +1,5 @@
 
-import      math
+import      threading
 import      numpy as np
 import      sounddevice as sd
 
@@ -8,6 +8,52 @@ from        typing      import      Type
 
 from        .           import      AudioData
 
+# numba is optional: block assembly is the same numpy code without it, just interpreted
+try:
+    from    numba       import      njit
+except ImportError:
+    njit = lambda *args, **kwargs: (lambda func: func)
+
+
+
+@njit(cache = True, nogil = True)
+def _assemble_block(source:     Type[np.ndarray],
+                    out:        Type[np.ndarray],
+                    position:   int,
+                    loop:       bool
+                    ) -> tuple[int, int]:
+    """
+    Fill `out` with the next block of frames to be played from `source`, starting at `position`
+
+    `source` is in playback order (i.e. the reversed copy of the audio when playing in reverse),
+    so it is always read forwards and the direction never has to be checked.
+    When looping, a block reaching the end of `source` is filled from the start again.
+    Otherwise, the rest of `out` is filled with zeros
+
+    Compiled with numba, if available. `nogil` lets this run without holding up the stream callback
+
+    Returns the number of frames copied into `out`, and the position following the block
+    """
+
+    framecount  = source.shape[0]
+    block_size  = out.shape[0]
+    position    = max(0, min(position, framecount))
+    filled      = 0
+
+    while filled < block_size:
+        frames = min(block_size - filled, framecount - position)
+        out[filled : filled + frames] = source[position : position + frames]
+        filled      += frames
+        position    += frames
+
+        if filled < block_size:
+            if not loop or framecount == 0:
+                break
+            position = 0
+
+    out[filled:] = 0
+    return filled, position
+
 
 
 class AudioStream:
@@ -16,7 +62,8 @@ class AudioStream:
     """
 
     # CONSTANTS
-    DEFAULT_BLOCK_SIZE  = 1024 # in frames
+    DEFAULT_BLOCK_SIZE  = 2048 # in frames
+    RING_BLOCKS         = 8    # size of the ring buffer, in blocks (MUST be a power of 2)
     MODE_STOPPED        = 0
     MODE_PAUSED         = 1
     MODE_PLAYING        = 2
@@ -24,7 +71,7 @@ class AudioStream:
 
     # TYPING
     # playback properties
-    curframe:   int     # index of current frame in AudioData   
+    curframe:   int     # index of current frame in AudioData (the next frame out of the ring buffer)
     _loop:      bool    # True to loop
     _direction: int     # 1 == forward, -1 == reverse
 
@@ -32,6 +79,27 @@ class AudioStream:
     _mode:      int # see MODE_* constants
     _stream:    Type[sd.OutputStream]
     _audio:     Type[AudioData]
+    _playback_data: Type[np.ndarray]    # the audio as played, in the playback datatype
+    _last_frame:    int                 # index of the last frame in the audio
+    _block_size:    int                 # DEFAULT_BLOCK_SIZE, kept on the instance for the callback
+    _audio_rev: Type[np.ndarray] | None # contiguous reversed copy of the audio, made on first reverse
+    _traversal: tuple[Type[np.ndarray], int, int] # (source, origin, step) for the current direction
+    _producer:  threading.Thread | None # fills `_ring` while playing
+    _next_frame:    int                 # frame following the last block put in the ring, only used by the producer
+    _pending_seek:  int | None          # frame to restart the ring from, posted while playing
+    _wake:          threading.Event     # set to wake the producer early (i.e. on a seek)
+
+    # ring buffer (single producer, single consumer)
+    # indices count blocks, and only ever increase: slot = idx & _ring_mask
+    _ring:              Type[np.ndarray]
+    _ring_slots:        list[Type[np.ndarray]]  # a view of each block-sized slot in _ring
+    _slot_frames:       list[int]   # frame following the block in each slot, becomes curframe once played
+    _ring_mask:         int         # RING_BLOCKS - 1
+    _read_idx:          int         # next block to play, only written by the stream callback
+    _write_idx:         int         # next block to fill, only written by the producer thread
+    _end_idx:           int | None  # block after the final block of audio, None if not yet reached
+    _refill_interval:   float       # seconds the producer sleeps for when the ring is full
+    _ring_lock:         threading.Lock  # held while a block is read, the ring is emptied, or a seek is posted
 
 
     def __init__(self, 
@@ -39,21 +107,57 @@ class AudioStream:
                  *,
                  loop:          bool            = False,
                  reverse:       bool            = False,
-                 fr_override:   int | None      = None
+                 fr_override:   int | None      = None,
+                 playback_dtype: np.dtype | None = None
                  ) -> None:
         """
         Create a new AudioStream using an 
+
+        If `playback_dtype` is given (e.g. np.int16), the audio is quantized down to it 
+        for playback, halving the data moved per block for 32-bit audio. 
+        The given AudioData is left intact.
         """
 
         # setup stream
+        # blocks are prepared ahead of time into the ring buffer by a producer thread,
+        # so all the stream callback does on the realtime audio thread is copy them out
         self._audio     = audiodata
+        # C-contiguous and of the stream's datatype, so blocks are copied out of it 
+        # as plain memcpys, rather than strided gathers or conversions
+        self._playback_data = np.ascontiguousarray(audiodata.data, dtype = audiodata.dtype)
+        if playback_dtype is not None:
+            self._playback_data = self._quantize(self._playback_data, playback_dtype)
+        assert self._playback_data.flags.c_contiguous
+        self._last_frame    = len(audiodata) - 1
+        self._block_size    = self.DEFAULT_BLOCK_SIZE
+        self._audio_rev = None
+        self._producer  = None
+        if self.RING_BLOCKS & (self.RING_BLOCKS - 1):
+            raise ValueError(f"RING_BLOCKS must be a power of 2. Given '{self.RING_BLOCKS}'")
+        self._ring_mask = self.RING_BLOCKS - 1
+        self._ring      = np.empty((self.RING_BLOCKS * self._block_size, self._audio.channels), dtype = self._playback_data.dtype)
+        self._ring_slots = [self._ring[slot : slot + self._block_size] for slot in range(0, len(self._ring), self._block_size)]
+        self._slot_frames = [0] * self.RING_BLOCKS
+        self._pending_seek = None
+        self._wake      = threading.Event()
+        self._ring_lock = threading.Lock()
+
+        # with numba, the kernel is compiled on its first call, holding the GIL throughout.
+        # compile it now rather than on the producer thread, where it'd starve the stream callback.
+        # numba compiles read-only and writable arrays separately: the playback data may be a 
+        # read-only view, but the reversed copy is always writable (as is the ring, so stands in for it)
+        _assemble_block(self._playback_data, self._ring_slots[0], 0, False)
+        _assemble_block(self._ring, self._ring_slots[0], 0, False)
+
         framerate       = fr_override if fr_override else self._audio.framerate
+        self._refill_interval = self._block_size / framerate / 2
         self._stream    = sd.OutputStream(samplerate        = framerate,
-                                          blocksize         = self.DEFAULT_BLOCK_SIZE,
+                                          blocksize         = self._block_size,
                                           channels          = self._audio.channels,
                                           callback          = self._next_block_callback,
                                           finished_callback = self._stop_playback_callback,
-                                          dtype             = audiodata.dtype) 
+                                          dtype             = self._playback_data.dtype,
+                                          latency           = "high") 
         
         # set playback and streaming state
         self._set_default_playback_state()
@@ -140,7 +244,21 @@ class AudioStream:
         if new_val != 1 and new_val != -1:
             raise ValueError(f"Invalid Direction: -1 and 1 are valid. Given '{new_val}'")
 
+        # reverse playback reads forwards through a reversed copy of the audio,
+        # as slicing with a negative step gives a strided view that has to be gathered per block
+        if new_val == -1 and self._audio_rev is None:
+            self._audio_rev = np.ascontiguousarray(self._playback_data[::-1])
+
+        # the producer works in positions along the source array (always forwards), where 
+        # frame == origin + (step * position). Set as one tuple so it is never seen half-updated
+        if new_val == 1:
+            self._traversal = (self._playback_data, 0, 1)
+        else:
+            self._traversal = (self._audio_rev, self._last_frame, -1)
+
+        # blocks already in the ring were read in the old direction
         self._direction = new_val
+        self._seek(self.curframe)
 
 
     def stop(self) -> None:
@@ -148,9 +266,8 @@ class AudioStream:
         Stop all playback and reset AudioStream to beginning
         """
 
-        if self._stream.active:
-            self._mode = self.MODE_STOPPED
-            self._stream.stop()
+        self._halt_playback(self.MODE_STOPPED)
+        self._set_default_playback_state()
 
 
     def pause(self) -> None:
@@ -158,9 +275,8 @@ class AudioStream:
         Pause playback at current position
         """
 
-        if self._stream.active:
-            self._mode = self.MODE_PAUSED
-            self._stream.stop()
+        if self._mode == self.MODE_PLAYING:
+            self._halt_playback(self.MODE_PAUSED)
 
 
     def play(self) -> None:
@@ -171,6 +287,14 @@ class AudioStream:
         jump to the end of the audio before playing
         """
 
+        if self._mode == self.MODE_PLAYING:
+            return
+
+        # a producer left over from reaching the end of the audio may still be exiting
+        if self._producer is not None:
+            self._producer.join()
+            self._producer = None
+
         # HACK !!!!
         # sounddevice.OutputStream
         # When playback is stopped due to reaching end of audio,
@@ -180,20 +304,35 @@ class AudioStream:
         # This, for whatever reason, fixes that :)
         if self._mode == self.MODE_STOPPED:
             self._stream.abort()
-
-        self._mode = self.MODE_PLAYING
-        if self._stream.stopped:
             if self.reverse:
                 self.jump_to_end()
-            self._stream.start()
 
+        # refill the ring from the current frame, dropping anything left in it from before pausing
+        self._flush_ring()
 
-    def jump(self, seconds: int) -> None:
+        # start filling the ring before the stream starts reading from it
+        self._mode      = self.MODE_PLAYING
+        self._producer  = threading.Thread(target = self._producer_loop, daemon = True)
+        self._producer.start()
+        self._stream.start()
+
+
+    def jump(self, seconds: int | float) -> None:
         """
         Jump to a specific time in the audiodata
+
+        Integer seconds are converted with integer arithmetic. Fractional seconds
+        are rounded to the nearest frame, so decimal times like 0.3 don't land a frame early
         """
 
-        self.jump_to_frame(math.floor(seconds * self.framerate))
+        # sounddevice gives the samplerate as a float
+        framerate = int(self.framerate)
+        if isinstance(seconds, int):
+            frame = seconds * framerate
+        else:
+            frame = int(round(seconds * framerate))
+
+        self.jump_to_frame(frame)
 
 
     def jump_to_frame(self, frame: int) -> None:
@@ -205,6 +344,7 @@ class AudioStream:
             raise ValueError("Cannot jump to frame outwith length of audio")
         
         self.curframe = frame
+        self._seek(frame)
 
 
     def jump_to_start(self) -> None:
@@ -220,7 +360,55 @@ class AudioStream:
         Jump to the end of the audio
         """
 
-        self.jump_to_frame(len(self._audio) - 1)
+        self.jump_to_frame(self._last_frame)
+
+
+    def _seek(self, frame: int) -> None:
+        """
+        Make the ring buffer continue from a given frame, rather than from where the producer left off
+
+        While playing, posts the frame for the producer thread to pick up before its next block
+        (waking it if need be), otherwise the ring is flushed straight away
+        """
+
+        if self._mode == self.MODE_PLAYING:
+            with self._ring_lock:
+                self._pending_seek = frame
+            self._wake.set()
+        else:
+            self._flush_ring()
+
+
+    def _flush_ring(self) -> None:
+        """
+        Empty the ring buffer, so it is refilled from `curframe`
+
+        MUST only be called when neither the producer thread nor the stream callback are running
+        """
+
+        self._write_idx     = self._read_idx
+        self._end_idx       = None
+        self._next_frame    = self.curframe
+        self._pending_seek  = None
+
+
+    def _halt_playback(self, mode: int) -> None:
+        """
+        Stop the internal `sounddevice.OutputStream` and the producer thread
+
+        Sets the playback mode to `mode` BEFORE stopping the stream, as this is 
+        checked by `_stop_playback_callback` and tells the producer thread to exit.
+        Does NOT touch the playback state (current frame, etc)
+        """
+
+        self._mode = mode
+        self._wake.set()
+        if self._stream.active:
+            self._stream.stop() if mode == self.MODE_PAUSED else self._stream.abort()
+
+        if self._producer is not None:
+            self._producer.join()
+            self._producer = None
 
 
     def _stop_playback_callback(self) -> None:
@@ -228,7 +416,8 @@ class AudioStream:
         `sounddevice.OutputStream` finish callback
 
         This is called when .stop() or .abort() is called on the 
-        internal `sounddevice.OutputStream` (when stopping and pausing playback)
+        internal `sounddevice.OutputStream` (when stopping and pausing playback),
+        or when the end of the audio has been played
 
         NOTE: Playback mode MUST be set BEFORE this is called 
         (i.e. before CallbackStop in callback, before called OutputStream.stop()/.abort())
@@ -249,8 +438,9 @@ class AudioStream:
         Does NOT stop playback, etc. Simply resets internal vars
         """
 
+        self._mode      = self.MODE_STOPPED
+        self._read_idx  = 0
         self.jump_to_start()
-        self._mode = self.MODE_STOPPED
 
 
     def _set_default_playback_props(self) -> None:
@@ -262,60 +452,102 @@ class AudioStream:
         self.reverse    = False
      
 
-    def _next_block_callback(self,
-                             outdata:    Type[np.ndarray],
-                             frames:     int,
-                             time:       Any, # CDATA
-                             status:     sd.CallbackFlags
-                             ) -> None:
+    @staticmethod
+    def _quantize(frame_array: Type[np.ndarray], dtype: np.dtype) -> Type[np.ndarray]:
         """
-        Sounddevice.stream callback
+        Quantize an array of integer samples down to a narrower integer datatype
+
+        Keeps the most significant bits of each sample. Returns the array as-is if already of `dtype`
+
+        Raises:
+        - `ValueError`: if `dtype` is not a signed integer datatype, or is wider than the datatype of the array
+        """
+
+        if np.dtype(dtype).kind != "i":
+            raise ValueError(f"Cannot quantize audio to '{np.dtype(dtype)}': must be a signed integer datatype")
+
+        shift = (frame_array.dtype.itemsize - np.dtype(dtype).itemsize) * 8
+        if shift < 0:
+            raise ValueError(f"Cannot quantize audio of datatype '{frame_array.dtype}' up to '{np.dtype(dtype)}'")
+
+        if shift == 0:
+            return frame_array
 
-        Fills the buffer `outdata` with the data of the next block of data.
-        If insufficient data to fill `outdata, fills with zeros
+        return (frame_array >> shift).astype(dtype)
 
-        Returns a slice or the input array, and the index of the last frame
+
+    def _producer_loop(self) -> None:
+        """
+        Producer thread target
+
+        Fills the ring buffer with the next blocks of data until playback is 
+        paused/stopped. Once the end of the audio is reached (when not looping), 
+        waits for the callback to finish playing it, or for a seek.
+        The final block is padded with zeros.
+
+        Seeks and direction changes empty the ring, so are heard from the next block played.
+        Changes to looping take up to `RING_BLOCKS` blocks
         """
 
-        def get_next_block(frame_array:   Type[np.array],
-                           direction:     int,
-                           start_frame:   int,
-                           slice_size:    int
-                           ) -> tuple[Type[np.array], int]:
+        while self._mode == self.MODE_PLAYING:
+            # empty the ring under the lock, so the callback is never part way through a block
+            with self._ring_lock:
+                seek, self._pending_seek = self._pending_seek, None
+                if seek is not None:
+                    self._write_idx = self._read_idx
+                    self._end_idx   = None
+
+            if seek is not None:
+                self._next_frame = seek
+
+            # a seek posted after the check above sets _wake, so is never slept through
+            if self._end_idx is not None or self._write_idx - self._read_idx >= self.RING_BLOCKS:
+                self._wake.wait(self._refill_interval)
+                self._wake.clear()
+                continue
 
-            is_within_bounds = lambda indx: True if 0 <= indx and indx < len(frame_array) else False
-            
-            # Get boundaries and check if within bounds
-            # Put boundaries in correct order (based on direction)
-            # (block boundaries in form [Given Frame, Is Within Bounds])
-            start       = start_frame
-            raw_end     = start + (slice_size * direction)
-            end         = raw_end if is_within_bounds(raw_end) else None
+            slot    = self._write_idx & self._ring_mask
 
-            # Calculate frame index of the last frame in new block
-            # if end falls outwith bounds, the endframe should be equal to:
-            # - 0 if direction == -1
-            # - len(frame_array) if direction == 1
-            end_frame_idx = raw_end if raw_end else len(frame_array) if direction == 1 else 0
+            source, origin, step = self._traversal
+            filled, position = _assemble_block(source, self._ring_slots[slot], step * (self._next_frame - origin), self._loop)
+            self._next_frame = origin + (step * position)
+            self._slot_frames[slot] = self._next_frame
 
-            return frame_array[start : end : direction], end_frame_idx
+            if filled < self._block_size:
+                # end MUST be marked before the block is published to the callback
+                self._end_idx   = self._write_idx + 1
 
+            self._write_idx += 1
 
 
+    def _next_block_callback(self,
+                             outdata:    Type[np.ndarray],
+                             frames:     int,
+                             time:       Any, # CDATA
+                             status:     sd.CallbackFlags
+                             ) -> None:
+        """
+        Sounddevice.stream callback
+
+        Fills the buffer `outdata` with the next block in the ring buffer, 
+        and moves `curframe` on to the frame following it.
+        If the producer thread has fallen behind, fills with zeros
+        """
+
         if status.output_underflow:
             print("WARN: OUTPUT UNDERFLOWING")
 
-        block_data, end_block_idx = get_next_block(self._audio.data, self._direction, self.curframe, self.DEFAULT_BLOCK_SIZE)
-
-        if len(block_data) < len(outdata):
-            outdata[:len(block_data)] = block_data
-            outdata[len(block_data):].fill(0)
-            if self.loop:
-                self.jump_to_end() if self.reverse else self.jump_to_start()
-            else:
+        # only ever held briefly by the other threads
+        with self._ring_lock:
+            read_idx = self._read_idx
+            if read_idx == self._end_idx:
                 raise sd.CallbackStop()
-            
-        else:
-            outdata[:] = block_data
-            self.curframe = end_block_idx
-        
\ No newline at end of file
+
+            if read_idx == self._write_idx:
+                outdata.fill(0)
+                return
+
+            slot            = read_idx & self._ring_mask
+            outdata[:]      = self._ring_slots[slot]
+            self.curframe   = self._slot_frames[slot]
+            self._read_idx  = read_idx + 1
@@ -1,4 +1,6 @@
 
+import      mmap
+import      os
 import      numpy as np
 import      pydub
 
@@ -19,15 +21,22 @@ class BaseAudioData:
     # CONSTANTS
     _FILEOBJ_SEEK_ABSOLUTE = 0
     _FILEOBJ_SEEK_RELATIVE = 1
+    _FILEOBJ_SEEK_END      = 2
+    _PREFETCH_CHUNKS       = 4 # chunks of the mapped source to prefetch ahead of each read
+    _SAMPLEWIDTH_DTYPES    = {1: np.dtype(np.int8), 2: np.dtype(np.int16), 4: np.dtype(np.int32), 8: np.dtype(np.int64)}
 
     # TYPING
     _source:        BinaryIO
+    _fd:            int | None # file descriptor of source, None if it has none (e.g. BytesIO)
+    _mm:            mmap.mmap | None        # read-only map of source, None if it can't be mapped
+    _mm_view:       memoryview | None       # view over _mm, slices of which are NOT copies
     _position:      int # frame number
     _framesize:     int # in bytes
     _channels:      int
     _samplewidth:   int # in bytes
     _framerate:     int
     _framecount:    int
+    _dtype:         np.dtype | None # None if samplewidth has no numpy datatype (e.g. 24-bit)
 
 
     def __init__(self,
@@ -45,12 +54,20 @@ class BaseAudioData:
         """
 
         self._source        = source
+        self._fd            = self._get_fileno(source)
+        self._mm            = self._map_source(source)
+        self._mm_view       = memoryview(self._mm) if self._mm is not None else None
+
+        # reads are mostly sequential, so let the kernel read ahead aggressively
+        if self._mm is not None and hasattr(mmap, "MADV_SEQUENTIAL"):
+            self._mm.madvise(mmap.MADV_SEQUENTIAL)
         self._position      = 0
         self._framesize     = (samplewidth * channels)
         self._channels      = channels
         self._samplewidth   = samplewidth
         self._framerate     = framerate
         self._framecount    = framecount
+        self._dtype         = self._SAMPLEWIDTH_DTYPES.get(samplewidth)
 
 
     #
@@ -80,8 +97,19 @@ class BaseAudioData:
     framecount: int = property(lambda self: self._framecount)
     """The total number of frames"""
 
-    datatype: np.dtype = property(lambda self: getattr(np, f"int{self.bitdepth}"))
-    """The datatype used for each sample when requesting frames"""
+    @property
+    def datatype(self) -> np.dtype:
+        """
+        The datatype used for each sample when requesting frames
+
+        Raises:
+        - `ValueError`: if there is no datatype for the samplewidth (e.g. 24-bit, packed in 3 bytes)
+        """
+
+        if self._dtype is None:
+            raise ValueError(f"No datatype for samples of width {self._samplewidth} bytes ({self.bitdepth}-bit)")
+
+        return self._dtype
 
 
     #
@@ -92,17 +120,17 @@ class BaseAudioData:
         Move position from current position by a given offset
         """
 
-        self._move_fileobj_cursor(frame_offset, self._FILEOBJ_SEEK_RELATIVE)
+        self._move_position(frame_offset, self._FILEOBJ_SEEK_RELATIVE)
 
 
     def jump(self, frame_offset: int) -> None:
         """
         Move position to a specific frame
 
-        Raises ValueError if given 
+        Raises ValueError if given frame is outwith the bounds of the audio data
         """
 
-        self._move_fileobj_cursor(frame_offset, self._FILEOBJ_SEEK_ABSOLUTE)
+        self._move_position(frame_offset, self._FILEOBJ_SEEK_ABSOLUTE)
 
 
     def read(self, frames: int) -> Type[np.array]:
@@ -114,7 +142,32 @@ class BaseAudioData:
 
         # get chunk of data and transform into numpy array
         return self._create_frame_array(self._get_chunk_from_infront(frames))
-        
+
+
+    def read_into(self, out: Type[np.array]) -> int:
+        """
+        Read frames from the current position to the right, straight into a given array.
+
+        Allows reading repeatedly into the same buffer rather than creating a new array each read.
+        `out` must be C-contiguous, of `datatype`, in shape (<frames>, channels).
+
+        Returns the number of frames read. Will be less than len(out) if insufficient frames to fill.
+        """
+
+        bytes_read = self.source.readinto(memoryview(out).cast("B"))
+        return (bytes_read or 0) // self._framesize
+
+
+    def read_planar(self, frames: int) -> Type[np.array]:
+        """
+        Read a number of frames from the current position to the right, in planar layout.
+
+        Returns an array in shape (channels, <length>), where each channel is contiguous,
+        for processing channels separately. `np.ascontiguousarray(<array>.T)` gives the
+        interleaved layout back.
+        """
+
+        return np.ascontiguousarray(self.read(frames).T)
 
 
     def read_left(self, frames: int) -> Type[np.array]:
@@ -133,32 +186,47 @@ class BaseAudioData:
     def _create_frame_array(self, byte_data: bytes) -> Type[np.array]:
         """
         Create a dimensional array from the given byte data in shape (<length>, channels)
+
+        The array is a read-only view over `byte_data`, NOT a copy
         """
         
         # create a dimensional array with the given byte data,
         # use known data about audio to form correctly
-        return np.ndarray(shape     = (len(byte_data // self.framesize), self.channels), 
-                          channels  = self.channels, 
-                          dtype     = self.datatype,
-                          buffer    = byte_data)
+        # (count drops any trailing partial frame, which would break the reshape)
+        frames = len(byte_data) // self._framesize
+        return np.frombuffer(byte_data, 
+                             dtype  = self.datatype, 
+                             count  = frames * self._channels).reshape(frames, self._channels)
     
 
-    def _get_chunk_from_infront(self, chunk_size: int) -> bytes:
+    def _get_chunk_from_infront(self, chunk_size: int) -> bytes | memoryview:
         """
         Get a chunk of bytes from audio data, reading from infront of current position
 
+        If source is memory-mapped, the chunk is a memoryview of the map rather than a copy
+
         Params:
         `chunk_size: int` - The size of the chunk to retrieve in frames
         """
 
-        return self.source.read(chunk_size)
+        size = chunk_size * self._framesize
+        if self._mm_view is None:
+            return self.source.read(size)
+
+        # slice the map instead of reading, but still move the cursor as read() would
+        start = self.source.tell()
+        chunk = self._mm_view[start : start + size]
+        self.source.seek(start + len(chunk))
+        self._prefetch(start + len(chunk), size * self._PREFETCH_CHUNKS)
+        return chunk
 
 
-    def _get_chunk_from_behind(self, chunk_size: int) -> bytes:
+    def _get_chunk_from_behind(self, chunk_size: int) -> bytes | memoryview:
         """
         Get a chunk of bytes from audio data, reading from behind current position
 
         Does NOT return the bytes in reverse order. Order is as in the original data
+        If source is memory-mapped, the chunk is a memoryview of the map rather than a copy
 
         Params:
         `chunk_size: int` - The size of the chunk to retrieve in frames
@@ -174,19 +242,84 @@ class BaseAudioData:
         # adjust the chunksize by the difference to avoid overshooting current frame
         starting_frame  = self.position - chunk_size
         if starting_frame < 0:
-            chunk_size = chunk_size - starting_frame
+            chunk_size = chunk_size + starting_frame
             starting_frame = 0
 
-        # we need to temporarily seek to the starting frame,
+        start   = starting_frame * self._framesize
+        size    = chunk_size * self._framesize
+
+        # if source is mapped, slice the map (prefetching the chunks behind, as reads go backwards)
+        if self._mm_view is not None:
+            self._prefetch(start - (size * self._PREFETCH_CHUNKS), size * self._PREFETCH_CHUNKS)
+            return self._mm_view[start : start + size]
+
+        # if source has a file descriptor, read at the starting frame 
+        # without touching the fileobj cursor at all
+        if self._fd is not None:
+            return os.pread(self._fd, size, start)
+
+        # otherwise, we need to temporarily seek to the starting frame,
         # without changing the current position
         self._move_fileobj_cursor(starting_frame, self._FILEOBJ_SEEK_ABSOLUTE)
-        chunk = self.source.read(chunk_size)
+        chunk = self.source.read(size)
 
         # seek back to position and return chunk data
         self._move_fileobj_cursor(self.position, self._FILEOBJ_SEEK_ABSOLUTE)
         return chunk
 
 
+    def _prefetch(self, start: int, size: int) -> None:
+        """
+        Advise the kernel that a range of bytes of the mapped source will be read soon
+
+        Range is clipped to the bounds of the source.
+        Does nothing if source isn't mapped, or the platform doesn't support madvise
+        """
+
+        if self._mm is None or not hasattr(mmap, "MADV_WILLNEED"):
+            return
+
+        # madvise needs a page-aligned start, and a range within the map
+        end     = min(start + size, len(self._mm))
+        start   = max(start, 0)
+        start   = start - (start % mmap.PAGESIZE)
+        if start < end:
+            self._mm.madvise(mmap.MADV_WILLNEED, start, end - start)
+
+
+    @staticmethod
+    def _get_fileno(source: BinaryIO) -> int | None:
+        """
+        Get the file descriptor of a given file object, if it can be used for positional reads
+
+        Returns None if the platform has no os.pread, or the file object has no file descriptor
+        """
+
+        if not hasattr(os, "pread"):
+            return None
+
+        # io.UnsupportedOperation is an OSError
+        try:
+            return source.fileno()
+        except (AttributeError, OSError):
+            return None
+
+
+    @staticmethod
+    def _map_source(source: BinaryIO) -> mmap.mmap | None:
+        """
+        Memory-map the file behind a given file object, read-only
+
+        Returns None if it cannot be mapped (e.g. no file descriptor, empty file, pipe)
+        """
+
+        # io.UnsupportedOperation is an OSError, mapping an empty file is a ValueError
+        try:
+            return mmap.mmap(source.fileno(), 0, access = mmap.ACCESS_READ)
+        except (AttributeError, OSError, ValueError):
+            return None
+
+
     def _move_position(self, frame_offset: int, mode: int = _FILEOBJ_SEEK_ABSOLUTE) -> None:
         """
         Move the current position and fileobj cursor to a given frame
@@ -203,18 +336,16 @@ class BaseAudioData:
         - `ValueError`: if frame_offset results in a new position outwith the bounds of the audio data
         """
 
-        try:
-            self._move_fileobj_cursor(frame_offset, mode)
-
-        except Exception as e:
-            self._position = (self.source.tell() // self.framesize)
+        # position is only updated if the cursor was moved (i.e. no ValueError)
+        self._position = self._move_fileobj_cursor(frame_offset, mode)
 
 
-    def _move_fileobj_cursor(self, frame_offset: int, mode: int = _FILEOBJ_SEEK_ABSOLUTE) -> None:
+    def _move_fileobj_cursor(self, frame_offset: int, mode: int = _FILEOBJ_SEEK_ABSOLUTE) -> int:
         """
         Move the internal file objects cursor to a given frame_offset
 
-        Does NOT change the current position, only the fileobj cursor
+        Does NOT change the current position, only the fileobj cursor.
+        Returns the frame the cursor was moved to
 
         Params:
         - `frame_offset: int` - The number of frames to move
@@ -228,12 +359,18 @@ class BaseAudioData:
         - `ValueError`: if frame_offset results in a new position outwith the bounds of the audio data
         """
 
-        # calculate the byte position of the frame offset
-        new_pos = (frame_offset * self.framesize)
+        # calculate the frame the cursor would end up on
+        if mode == self._FILEOBJ_SEEK_RELATIVE:
+            new_frame = (self.source.tell() // self._framesize) + frame_offset
+        elif mode == self._FILEOBJ_SEEK_END:
+            new_frame = self._framecount + frame_offset
+        else:
+            new_frame = frame_offset
 
         # check that the frame position to jump to is within bounds
-        if new_pos < 0 or new_pos >= self.framecount:
-            ValueError(f"Cannot seek to a frame {new_pos} (given frame offset {frame_offset}): Out of Bounds")
+        if new_frame < 0 or new_frame >= self._framecount:
+            raise ValueError(f"Cannot seek to a frame {new_frame} (given frame offset {frame_offset}): Out of Bounds")
 
         # if no error, jump !!!
-        self.source.seek(new_pos, mode)
\ No newline at end of file
+        self.source.seek(new_frame * self._framesize, self._FILEOBJ_SEEK_ABSOLUTE)
+        return new_frame
\ No newline at end of file